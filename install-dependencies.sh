@@ -34,6 +34,8 @@ case "$DISTRO" in
             sox \
             python3 \
             python3-pip \
+            python3-numpy \
+            python3-soundfile \
             python3-matplotlib
         ;;
     
@@ -48,6 +50,8 @@ case "$DISTRO" in
             sox \
             python3 \
             python3-pip \
+            python3-numpy \
+            python3-soundfile \
             python3-matplotlib
         ;;
     
@@ -61,6 +65,8 @@ case "$DISTRO" in
             sox \
             python \
             python-pip \
+            python-numpy \
+            python-soundfile \
             python-matplotlib
         ;;
     
@@ -75,6 +81,8 @@ case "$DISTRO" in
             sox \
             python3 \
             python3-pip \
+            python3-numpy \
+            python3-soundfile \
             python3-matplotlib
         ;;
     
@@ -88,6 +96,7 @@ case "$DISTRO" in
         echo "  - libsndfile (development headers)"
         echo "  - SoX (Sound eXchange)"
         echo "  - Python 3 with pip"
+        echo "  - Python numpy and soundfile libraries"
         echo "  - Python matplotlib library"
         exit 1
         ;;
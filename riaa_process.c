@@ -2,20 +2,171 @@
  * riaa_process.c - Process audio file with RIAA plugin and show statistics
  * 
  * Usage: riaa_process input.wav output.wav [gain] [subsonic] [riaa_enable] [declick_enable] [spike_threshold] [spike_width]
+ *        riaa_process --stdin-mode samplerate [gain] [subsonic] [riaa_enable] ...
+ *
+ * In stdin mode the plugin is loaded once and measurement requests are read
+ * from stdin, one per line: "frequency duration trim_start trim_len" (Hz and
+ * seconds). For each request a full-scale stereo sine is generated, processed
+ * from a freshly activated plugin state and the RMS of both output channels
+ * over the trimmed segment is written to stdout as "rms_l rms_r".
  */
 
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <math.h>
 #include <dlfcn.h>
 #include <sndfile.h>
 #include <ladspa.h>
 
 #define BUFFER_SIZE 8192
 
+static int run_stdin_mode(int argc, char *argv[]) {
+    if (argc < 3) {
+        fprintf(stderr, "Usage: %s --stdin-mode samplerate [gain] [subsonic] [riaa_enable] [declick_enable] [spike_threshold] [spike_width] [notch_enable] [notch_freq] [notch_q]\n", argv[0]);
+        return 1;
+    }
+    
+    unsigned long sample_rate = strtoul(argv[2], NULL, 10);
+    
+    // Control values, same positions and defaults as in file mode
+    float gain = (argc > 3) ? atof(argv[3]) : 0.0f;
+    float subsonic = (argc > 4) ? atof(argv[4]) : 0.0f;
+    float riaa_enable = (argc > 5) ? atof(argv[5]) : 1.0f;
+    float declick_enable = (argc > 6) ? atof(argv[6]) : 0.0f;
+    float spike_threshold = (argc > 7) ? atof(argv[7]) : 20.0f;
+    float spike_width = (argc > 8) ? atof(argv[8]) : 1.0f;
+    float notch_enable = (argc > 9) ? atof(argv[9]) : 0.0f;
+    float notch_freq = (argc > 10) ? atof(argv[10]) : 50.0f;
+    float notch_q = (argc > 11) ? atof(argv[11]) : 10.0f;
+    
+    // Control input ports 0-9 (the plugin may overwrite them in activate(),
+    // so they are restored per request); store settings is always 0
+    float controls[10];
+    float values[10] = {gain, subsonic, riaa_enable, declick_enable, spike_threshold,
+                        spike_width, notch_enable, notch_freq, notch_q, 0.0f};
+    float outputs[4] = {0.0f, 0.0f, 0.0f, 0.0f};
+    
+    // Load LADSPA plugin
+    void *plugin_lib = dlopen("/usr/local/lib/ladspa/riaa.so", RTLD_NOW);
+    if (!plugin_lib) {
+        fprintf(stderr, "Error: Could not load LADSPA plugin\n");
+        fprintf(stderr, "%s\n", dlerror());
+        return 1;
+    }
+    
+    LADSPA_Descriptor_Function descriptor_fn = 
+        (LADSPA_Descriptor_Function)dlsym(plugin_lib, "ladspa_descriptor");
+    const LADSPA_Descriptor *descriptor = descriptor_fn ? descriptor_fn(0) : NULL;
+    if (!descriptor) {
+        fprintf(stderr, "Error: Could not get plugin descriptor\n");
+        dlclose(plugin_lib);
+        return 1;
+    }
+    
+    LADSPA_Handle handle = descriptor->instantiate(descriptor, sample_rate);
+    if (!handle) {
+        fprintf(stderr, "Error: Could not instantiate plugin at %lu Hz\n", sample_rate);
+        dlclose(plugin_lib);
+        return 1;
+    }
+    
+    float *input_l = (float *)malloc(BUFFER_SIZE * sizeof(float));
+    float *input_r = (float *)malloc(BUFFER_SIZE * sizeof(float));
+    float *output_l = (float *)malloc(BUFFER_SIZE * sizeof(float));
+    float *output_r = (float *)malloc(BUFFER_SIZE * sizeof(float));
+    
+    // Same port layout as in file mode
+    for (int i = 0; i < 10; i++) {
+        descriptor->connect_port(handle, i, &controls[i]);
+    }
+    for (int i = 0; i < 4; i++) {
+        descriptor->connect_port(handle, 10 + i, &outputs[i]);
+    }
+    descriptor->connect_port(handle, 14, input_l);
+    descriptor->connect_port(handle, 15, input_r);
+    descriptor->connect_port(handle, 16, output_l);
+    descriptor->connect_port(handle, 17, output_r);
+    
+    char line[256];
+    int active = 0;
+    while (fgets(line, sizeof(line), stdin)) {
+        double frequency, duration, trim_start, trim_len;
+        if (sscanf(line, "%lf %lf %lf %lf", &frequency, &duration, &trim_start, &trim_len) != 4) {
+            printf("error\n");
+            fflush(stdout);
+            continue;
+        }
+        
+        // Reset the DSP state, then apply the requested control values
+        // (activate() loads the saved defaults into the control ports)
+        if (active && descriptor->deactivate) {
+            descriptor->deactivate(handle);
+        }
+        if (descriptor->activate) {
+            descriptor->activate(handle);
+        }
+        active = 1;
+        memcpy(controls, values, sizeof(controls));
+        
+        long total = (long)(duration * sample_rate);
+        long seg_start = (long)(trim_start * sample_rate);
+        long seg_end = (long)((trim_start + trim_len) * sample_rate);
+        double phase_inc = 2.0 * M_PI * frequency / sample_rate;
+        double sum_l = 0.0, sum_r = 0.0;
+        long count = 0;
+        
+        for (long pos = 0; pos < total; pos += BUFFER_SIZE) {
+            long n = total - pos < BUFFER_SIZE ? total - pos : BUFFER_SIZE;
+            for (long i = 0; i < n; i++) {
+                input_l[i] = input_r[i] = (float)sin(phase_inc * (pos + i));
+            }
+            
+            descriptor->run(handle, n);
+            
+            // Accumulate squares inside the trimmed segment only
+            for (long i = 0; i < n; i++) {
+                long frame = pos + i;
+                if (frame >= seg_start && frame < seg_end) {
+                    sum_l += (double)output_l[i] * output_l[i];
+                    sum_r += (double)output_r[i] * output_r[i];
+                    count++;
+                }
+            }
+        }
+        
+        if (count > 0) {
+            printf("%.9g %.9g\n", sqrt(sum_l / count), sqrt(sum_r / count));
+        } else {
+            printf("error\n");
+        }
+        fflush(stdout);
+    }
+    
+    // Cleanup
+    if (active && descriptor->deactivate) {
+        descriptor->deactivate(handle);
+    }
+    descriptor->cleanup(handle);
+    
+    free(input_l);
+    free(input_r);
+    free(output_l);
+    free(output_r);
+    
+    dlclose(plugin_lib);
+    
+    return 0;
+}
+
 int main(int argc, char *argv[]) {
+    if (argc > 1 && strcmp(argv[1], "--stdin-mode") == 0) {
+        return run_stdin_mode(argc, argv);
+    }
+    
     if (argc < 3) {
         fprintf(stderr, "Usage: %s input.wav output.wav [gain] [subsonic] [riaa_enable] [declick_enable] [spike_threshold] [spike_width] [notch_enable] [notch_freq] [notch_q]\n", argv[0]);
+        fprintf(stderr, "       %s --stdin-mode samplerate [gain] [subsonic] ...\n", argv[0]);
         fprintf(stderr, "\nDefaults:\n");
         fprintf(stderr, "  gain: 0.0 dB\n");
         fprintf(stderr, "  subsonic: 0 (off)\n");
@@ -146,15 +297,15 @@ int main(int argc, char *argv[]) {
     descriptor->connect_port(handle, 6, &notch_enable);         // Notch Enable
     descriptor->connect_port(handle, 7, &notch_freq);           // Notch Frequency
     descriptor->connect_port(handle, 8, &notch_q);              // Notch Q
-    descriptor->connect_port(handle, 9, &clipped_samples);      // Clipped Samples (output)
-    descriptor->connect_port(handle, 10, &detected_clicks);     // Detected Clicks (output)
-    descriptor->connect_port(handle, 11, &avg_spike_length);    // Average Spike Length (output)
-    descriptor->connect_port(handle, 12, &avg_rms_db);          // Average RMS dB (output)
-    descriptor->connect_port(handle, 13, input_l);              // Input L
-    descriptor->connect_port(handle, 14, input_r);              // Input R
-    descriptor->connect_port(handle, 15, output_l);             // Output L
-    descriptor->connect_port(handle, 16, output_r);             // Output R
-    descriptor->connect_port(handle, 17, &store_settings);      // Store settings
+    descriptor->connect_port(handle, 9, &store_settings);       // Store settings
+    descriptor->connect_port(handle, 10, &clipped_samples);     // Clipped Samples (output)
+    descriptor->connect_port(handle, 11, &detected_clicks);     // Detected Clicks (output)
+    descriptor->connect_port(handle, 12, &avg_spike_length);    // Average Spike Length (output)
+    descriptor->connect_port(handle, 13, &avg_rms_db);          // Average RMS dB (output)
+    descriptor->connect_port(handle, 14, input_l);              // Input L
+    descriptor->connect_port(handle, 15, input_r);              // Input R
+    descriptor->connect_port(handle, 16, output_l);             // Output L
+    descriptor->connect_port(handle, 17, output_r);             // Output R
     
     printf("Processing settings:\n");
     printf("  Gain: %.1f dB\n", gain);
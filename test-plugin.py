@@ -6,14 +6,22 @@ Tests LADSPA plugins by sweeping through frequencies and measuring
 the output amplitude to generate frequency response curves.
 """
 
+import os
 import sys
+import shutil
 import subprocess
 import math
 import re
 import tempfile
 import argparse
+import asyncio
+import ctypes
+from contextlib import contextmanager
 from pathlib import Path
 
+import numpy as np
+import soundfile as sf
+
 try:
     import matplotlib.pyplot as plt
     import matplotlib
@@ -23,6 +31,471 @@ except ImportError:
     HAS_MATPLOTLIB = False
     print("Warning: matplotlib not available, no plots will be generated", file=sys.stderr)
 
+try:
+    from scipy.signal import bilinear_zpk, zpk2tf, freqs_zpk, butter, iirnotch, tf2sos, sosfilt
+    from scipy.optimize import least_squares
+    HAS_SCIPY = True
+except ImportError:
+    HAS_SCIPY = False
+
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+
+if HAS_NUMBA:
+    @njit(fastmath=True, parallel=True)
+    def rms_segment(data, start, stop):
+        """RMS of each column of data[start:stop], in one pass without temporaries."""
+        length = max(stop - start, 1)
+        rms = np.empty(data.shape[1])
+        for ch in range(data.shape[1]):
+            acc = 0.0
+            for i in prange(start, stop):
+                x = np.float64(data[i, ch])
+                acc += x * x
+            rms[ch] = math.sqrt(acc / length)
+        return rms
+else:
+    def rms_segment(data, start, stop):
+        """RMS of each column of data[start:stop]."""
+        # Accumulate in double precision, up to 288k samples per channel are summed
+        seg = data[start:stop].astype(np.float64)
+        return np.sqrt((seg ** 2).mean(axis=0))
+
+
+# Values riaa_process uses for riaa control ports that have no default hint
+RIAA_PORT_DEFAULTS = {
+    'Notch Frequency (Hz)': 50.0,
+    'Notch Q Factor': 10.0,
+}
+
+# Quoted port/plugin name in analyseplugin output
+_NAME_RE = re.compile(r'"([^"]+)"')
+
+# LADSPA port descriptor and hint bits (see ladspa.h)
+LADSPA_PORT_INPUT = 0x1
+LADSPA_PORT_OUTPUT = 0x2
+LADSPA_PORT_CONTROL = 0x4
+LADSPA_PORT_AUDIO = 0x8
+
+LADSPA_HINT_BOUNDED_BELOW = 0x1
+LADSPA_HINT_BOUNDED_ABOVE = 0x2
+LADSPA_HINT_SAMPLE_RATE = 0x8
+LADSPA_HINT_LOGARITHMIC = 0x10
+LADSPA_HINT_DEFAULT_MASK = 0x3C0
+LADSPA_HINT_DEFAULT_MINIMUM = 0x40
+LADSPA_HINT_DEFAULT_LOW = 0x80
+LADSPA_HINT_DEFAULT_MIDDLE = 0xC0
+LADSPA_HINT_DEFAULT_HIGH = 0x100
+LADSPA_HINT_DEFAULT_MAXIMUM = 0x140
+LADSPA_HINT_DEFAULT_0 = 0x200
+LADSPA_HINT_DEFAULT_1 = 0x240
+LADSPA_HINT_DEFAULT_100 = 0x280
+LADSPA_HINT_DEFAULT_440 = 0x2C0
+
+# Block size used when calling run(), same as riaa_process
+# (declick needs at least 4096 samples per block)
+LADSPA_BLOCK_SIZE = 8192
+
+
+class LADSPA_PortRangeHint(ctypes.Structure):
+    _fields_ = [
+        ('HintDescriptor', ctypes.c_int),
+        ('LowerBound', ctypes.c_float),
+        ('UpperBound', ctypes.c_float),
+    ]
+
+
+class LADSPA_Descriptor(ctypes.Structure):
+    pass
+
+
+LADSPA_Handle = ctypes.c_void_p
+LADSPA_Descriptor._fields_ = [
+    ('UniqueID', ctypes.c_ulong),
+    ('Label', ctypes.c_char_p),
+    ('Properties', ctypes.c_int),
+    ('Name', ctypes.c_char_p),
+    ('Maker', ctypes.c_char_p),
+    ('Copyright', ctypes.c_char_p),
+    ('PortCount', ctypes.c_ulong),
+    ('PortDescriptors', ctypes.POINTER(ctypes.c_int)),
+    ('PortNames', ctypes.POINTER(ctypes.c_char_p)),
+    ('PortRangeHints', ctypes.POINTER(LADSPA_PortRangeHint)),
+    ('ImplementationData', ctypes.c_void_p),
+    ('instantiate', ctypes.CFUNCTYPE(LADSPA_Handle, ctypes.POINTER(LADSPA_Descriptor), ctypes.c_ulong)),
+    ('connect_port', ctypes.CFUNCTYPE(None, LADSPA_Handle, ctypes.c_ulong, ctypes.POINTER(ctypes.c_float))),
+    ('activate', ctypes.CFUNCTYPE(None, LADSPA_Handle)),
+    ('run', ctypes.CFUNCTYPE(None, LADSPA_Handle, ctypes.c_ulong)),
+    ('run_adding', ctypes.CFUNCTYPE(None, LADSPA_Handle, ctypes.c_ulong)),
+    ('set_run_adding_gain', ctypes.CFUNCTYPE(None, LADSPA_Handle, ctypes.c_float)),
+    ('deactivate', ctypes.CFUNCTYPE(None, LADSPA_Handle)),
+    ('cleanup', ctypes.CFUNCTYPE(None, LADSPA_Handle)),
+]
+
+
+@contextmanager
+def quiet_stderr():
+    """Temporarily redirect the process-level stderr (fd 2) to /dev/null."""
+    sys.stderr.flush()
+    saved = os.dup(2)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(devnull, 2)
+        yield
+    finally:
+        os.dup2(saved, 2)
+        os.close(devnull)
+        os.close(saved)
+
+
+class LadspaPlugin:
+    """
+    In-process LADSPA host based on ctypes.
+    
+    The shared object is loaded and instantiated once; every call to
+    process() resets the DSP state with activate() and runs the signal
+    through the plugin directly from NumPy buffers.
+    """
+    
+    def __init__(self, path, sample_rate, parameters, label=None, defaults=None):
+        self.lib = ctypes.CDLL(path)
+        descriptor_fn = self.lib.ladspa_descriptor
+        descriptor_fn.restype = ctypes.POINTER(LADSPA_Descriptor)
+        descriptor_fn.argtypes = [ctypes.c_ulong]
+        
+        # A library may contain several plugins; pick the one with the
+        # requested label (or the first one if no label is given)
+        index = 0
+        while True:
+            descriptor_ptr = descriptor_fn(index)
+            if not descriptor_ptr:
+                raise RuntimeError(f"No LADSPA plugin with label {label} in {path}")
+            if label is None or descriptor_ptr.contents.Label.decode() == label:
+                break
+            index += 1
+        self.descriptor_ptr = descriptor_ptr
+        self.descriptor = descriptor_ptr.contents
+        
+        port_descs = [self.descriptor.PortDescriptors[i] for i in range(self.descriptor.PortCount)]
+        if not any(d & LADSPA_PORT_AUDIO and d & LADSPA_PORT_OUTPUT for d in port_descs):
+            raise RuntimeError(f"Plugin {label} in {path} has no audio outputs")
+        
+        self.handle = self.descriptor.instantiate(descriptor_ptr, sample_rate)
+        if not self.handle:
+            raise RuntimeError(f"Could not instantiate plugin {path} at {sample_rate} Hz")
+        self.sample_rate = sample_rate
+        self.active = False
+        
+        # Connect every port to a NumPy buffer owned by this object
+        self.controls = []  # (buffer, value) for every control input
+        self.inputs = []
+        self.outputs = []
+        self.buffers = []
+        param_index = 0
+        for port in range(self.descriptor.PortCount):
+            port_desc = self.descriptor.PortDescriptors[port]
+            if port_desc & LADSPA_PORT_AUDIO:
+                buf = np.zeros(LADSPA_BLOCK_SIZE, dtype=np.float32)
+                if port_desc & LADSPA_PORT_INPUT:
+                    self.inputs.append(buf)
+                else:
+                    self.outputs.append(buf)
+            else:
+                buf = np.zeros(1, dtype=np.float32)
+                if port_desc & LADSPA_PORT_INPUT:
+                    # Control inputs take the command line parameters in port
+                    # order, then the caller's defaults (by port name), then
+                    # the port's own default
+                    name = self.descriptor.PortNames[port].decode()
+                    if param_index < len(parameters):
+                        value = float(parameters[param_index])
+                    elif defaults and name in defaults:
+                        value = defaults[name]
+                    else:
+                        value = self._default_value(port)
+                    param_index += 1
+                    buf[0] = value
+                    self.controls.append((buf, value))
+            self.buffers.append(buf)
+            self.descriptor.connect_port(
+                self.handle, port, buf.ctypes.data_as(ctypes.POINTER(ctypes.c_float))
+            )
+    
+    def _default_value(self, port):
+        """Default value of a control port, derived from its range hint."""
+        hint = self.descriptor.PortRangeHints[port]
+        lower = hint.LowerBound
+        upper = hint.UpperBound
+        if hint.HintDescriptor & LADSPA_HINT_SAMPLE_RATE:
+            lower *= self.sample_rate
+            upper *= self.sample_rate
+        
+        log = hint.HintDescriptor & LADSPA_HINT_LOGARITHMIC and lower > 0 and upper > 0
+        
+        def between(weight):
+            if log:
+                return math.exp(math.log(lower) * (1 - weight) + math.log(upper) * weight)
+            return lower * (1 - weight) + upper * weight
+        
+        def clamp(value):
+            if hint.HintDescriptor & LADSPA_HINT_BOUNDED_BELOW:
+                value = max(value, lower)
+            if hint.HintDescriptor & LADSPA_HINT_BOUNDED_ABOVE:
+                value = min(value, upper)
+            return value
+        
+        default = hint.HintDescriptor & LADSPA_HINT_DEFAULT_MASK
+        if default == LADSPA_HINT_DEFAULT_MINIMUM:
+            return lower
+        if default == LADSPA_HINT_DEFAULT_LOW:
+            return between(0.25)
+        if default == LADSPA_HINT_DEFAULT_MIDDLE:
+            return between(0.5)
+        if default == LADSPA_HINT_DEFAULT_HIGH:
+            return between(0.75)
+        if default == LADSPA_HINT_DEFAULT_MAXIMUM:
+            return upper
+        if default == LADSPA_HINT_DEFAULT_1:
+            return 1.0
+        if default == LADSPA_HINT_DEFAULT_100:
+            return 100.0
+        if default == LADSPA_HINT_DEFAULT_440:
+            return 440.0
+        if default == LADSPA_HINT_DEFAULT_0:
+            return 0.0
+        # No default hint: 0, moved into the port's range if needed
+        return clamp(0.0)
+    
+    def reset(self):
+        """Reset the DSP state and (re)apply the control values."""
+        with quiet_stderr():
+            if self.active and self.descriptor.deactivate:
+                self.descriptor.deactivate(self.handle)
+            if self.descriptor.activate:
+                self.descriptor.activate(self.handle)
+        self.active = True
+        
+        # activate() may load saved settings (e.g. from the user's HOME) into
+        # the control ports, so every control value is written afterwards
+        for buf, value in self.controls:
+            buf[0] = value
+    
+    def process(self, signal):
+        """
+        Run a signal of shape (frames, inputs) through the plugin.
+        
+        Returns the output as a float32 array of shape (frames, outputs).
+        """
+        self.reset()
+        
+        frames = signal.shape[0]
+        output = np.empty((frames, len(self.outputs)), dtype=np.float32)
+        for start in range(0, frames, LADSPA_BLOCK_SIZE):
+            n = min(LADSPA_BLOCK_SIZE, frames - start)
+            for ch, buf in enumerate(self.inputs):
+                buf[:n] = signal[start:start + n, ch % signal.shape[1]]
+            self.descriptor.run(self.handle, n)
+            for ch, buf in enumerate(self.outputs):
+                output[start:start + n, ch] = buf[:n]
+        return output
+    
+    def close(self):
+        """Deactivate and free the plugin instance."""
+        if self.handle is None:
+            return
+        if self.active and self.descriptor.deactivate:
+            self.descriptor.deactivate(self.handle)
+        self.descriptor.cleanup(self.handle)
+        self.handle = None
+
+
+class RiaaReference:
+    """
+    Reference model of the riaa plugin built from the standard RIAA time constants.
+    
+    The target is the analog playback curve
+    H(s) = (1 + s*T2) / ((1 + s*T1) * (1 + s*T3)) with T1 = 3180 us,
+    T2 = 318 us and T3 = 75 us, normalised to 0 dB at DC like the plugin.
+    
+    A plain bilinear transform of H(s) maps the excess pole's zero to
+    Nyquist and is already 1.3 dB low at 10 kHz at 48 kHz, which is useless
+    as a reference. Instead, the pre-warped bilinear design is used as the
+    starting point for a third-order IIR whose coefficients are fitted by
+    least squares to the analog magnitude in dB, from 1 Hz to 95% of
+    Nyquist. At 44.1 and 48 kHz this stays within 0.03 dB of the analog
+    curve up to 20 kHz (0.06 dB over the whole fit range).
+    
+    After the fit, the largest deviation is measured on a dense grid.
+    `f_max_valid` is the highest frequency up to which the deviation stays
+    within MAX_ERROR_DB; comparisons above it are not meaningful.
+    
+    Subsonic and notch filters are added as extra second-order sections and
+    the gain is applied last. Declick is not modelled.
+    
+    Parameters are positional, in the same order as for riaa_process.
+    """
+    
+    T1 = 3180e-6
+    T2 = 318e-6
+    T3 = 75e-6
+    
+    # Largest deviation from the analog curve accepted for comparisons
+    MAX_ERROR_DB = 0.1
+    
+    def __init__(self, sample_rate, parameters):
+        values = [float(p) for p in parameters]
+        defaults = [0.0, 0.0, 1.0, 0.0, 20.0, 1.0, 0.0, 50.0, 10.0]
+        values += defaults[len(values):]
+        gain, subsonic, riaa_enable, declick_enable, _, _, notch_enable, notch_freq, notch_q = values[:9]
+        
+        if declick_enable:
+            print("Warning: declick is not part of the reference model and is ignored", file=sys.stderr)
+        
+        sections = []
+        if int(subsonic + 0.5) in (1, 2):
+            sections.append(butter(int(subsonic + 0.5), 20.0, 'highpass', fs=sample_rate, output='sos'))
+        if int(riaa_enable + 0.5):
+            sections.append(self._riaa_sos(sample_rate))
+        if int(notch_enable + 0.5):
+            b, a = iirnotch(notch_freq, notch_q, fs=sample_rate)
+            sections.append(tf2sos(b, a))
+        
+        self.sos = np.vstack(sections) if sections else None
+        self.gain = 10 ** (gain / 20)
+        
+        if not int(riaa_enable + 0.5):
+            self.f_max_valid = sample_rate / 2
+            self.max_error_db = 0.0
+    
+    def _analog_db(self, frequencies):
+        """Magnitude of the analog RIAA playback curve in dB."""
+        w1, w2, w3 = 1 / self.T1, 1 / self.T2, 1 / self.T3
+        # H(s) = (w1 * w3 / w2) * (s + w2) / ((s + w1) * (s + w3)), unity gain at DC
+        _, h = freqs_zpk([-w2], [-w1, -w3], w1 * w3 / w2, 2 * np.pi * frequencies)
+        return 20 * np.log10(np.abs(h))
+    
+    def _riaa_sos(self, sample_rate):
+        """Digital RIAA playback filter fitted to the analog curve, as second-order sections."""
+        def warp(tau):
+            # Pre-warped angular frequency of the corner 1/tau
+            return 2 * sample_rate * math.tan(1 / (2 * sample_rate * tau))
+        
+        # Starting point: bilinear transform, padded to third order
+        w1, w2, w3 = warp(self.T1), warp(self.T2), warp(self.T3)
+        z, p, k = bilinear_zpk([-w2], [-w1, -w3], w1 * w3 / w2, sample_rate)
+        b, a = zpk2tf(z, p, k)
+        x0 = np.concatenate([b, [0.0], a[1:], [0.0]])
+        
+        def response_db(x, frequencies):
+            zinv = np.exp(-2j * np.pi * frequencies / sample_rate)
+            num = np.polyval(x[3::-1], zinv)
+            den = np.polyval(np.concatenate([x[:3:-1], [1.0]]), zinv)
+            return 20 * np.log10(np.abs(num / den))
+        
+        # Fit all coefficients to the analog magnitude in dB
+        fit_freqs = np.geomspace(1.0, 0.95 * sample_rate / 2, 400)
+        target = self._analog_db(fit_freqs)
+        x = least_squares(lambda x: response_db(x, fit_freqs) - target, x0, method='lm').x
+        
+        b = x[:4]
+        a = np.concatenate([[1.0], x[4:]])
+        if np.any(np.abs(np.roots(a)) >= 1):
+            raise RuntimeError(f"RIAA reference fit is unstable at {sample_rate} Hz")
+        
+        # Highest frequency up to which the fit stays within MAX_ERROR_DB
+        check_freqs = np.geomspace(1.0, sample_rate / 2, 2000)
+        error = np.abs(response_db(x, check_freqs) - self._analog_db(check_freqs))
+        bad = np.nonzero(error > self.MAX_ERROR_DB)[0]
+        self.f_max_valid = check_freqs[bad[0] - 1] if len(bad) else sample_rate / 2
+        self.max_error_db = error[check_freqs <= self.f_max_valid].max()
+        
+        return tf2sos(b, a)
+    
+    def process(self, signal):
+        """Filter a signal of shape (frames, channels) like LadspaPlugin.process()."""
+        if self.sos is None:
+            out = signal.astype(np.float64)
+        else:
+            out = sosfilt(self.sos, signal, axis=0)
+        return (out * self.gain).astype(np.float32)
+    
+    def close(self):
+        pass
+
+
+class RiaaCoprocess:
+    """
+    Persistent `riaa_process --stdin-mode` instance.
+    
+    The plugin is loaded and instantiated once by the co-process; every
+    measurement is a single request/response line over its stdin/stdout.
+    """
+    
+    def __init__(self, sample_rate, parameters):
+        self.proc = None
+        # stderr goes to a file rather than a pipe nobody reads, so the
+        # co-process cannot block on it and its messages can be reported
+        self.stderr = tempfile.TemporaryFile(mode='w+')
+        self.proc = subprocess.Popen(
+            ['./riaa_process', '--stdin-mode', str(sample_rate)] + parameters,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self.stderr,
+            close_fds=False,
+            text=True
+        )
+        self.check_running()
+    
+    def check_running(self):
+        """Raise RuntimeError with the co-process's messages if it has exited."""
+        status = self.proc.poll()
+        if status is None:
+            return
+        self.stderr.seek(0)
+        lines = [line.strip() for line in self.stderr if line.strip()]
+        detail = lines[-1] if lines else f"exit status {status}"
+        raise RuntimeError(f"riaa_process exited ({detail})")
+    
+    def measure(self, frequency, duration, trim_start, trim_len):
+        """
+        Return the RMS of both output channels over the trimmed segment,
+        or None if the request failed.
+        
+        Raises RuntimeError if the co-process is no longer running.
+        """
+        try:
+            self.proc.stdin.write(f"{frequency} {duration} {trim_start} {trim_len}\n")
+            self.proc.stdin.flush()
+            reply = self.proc.stdout.readline().split()
+        except BrokenPipeError:
+            reply = []
+        if not reply:
+            # End of file: the co-process is gone
+            self.proc.wait()
+            self.check_running()
+        if len(reply) != 2 or reply[0] == 'error':
+            return None
+        return [float(v) for v in reply]
+    
+    def close(self):
+        """Ask the co-process to exit by closing its stdin."""
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        self.proc.wait()
+        self.proc = None
+        self.stderr.close()
+    
+    def __del__(self):
+        self.close()
+
 
 class PluginTester:
     def __init__(self):
@@ -30,8 +503,20 @@ class PluginTester:
         self.f_min = 5
         self.f_max = 50000
         self.steps_per_oct = 12
+        self.jobs = 2 * (os.cpu_count() or 1)
+        
+        # External tools with their full path: subprocess only uses the
+        # posix_spawn() fast path when the executable contains a directory
+        self.sox = shutil.which('sox') or 'sox'
+        self.analyseplugin = shutil.which('analyseplugin') or 'analyseplugin'
+        
+        # Keep temporary WAV files in RAM (tmpfs) when available
+        self.tmp_root = '/dev/shm' if os.access('/dev/shm', os.W_OK) else None
+        self.backend = 'ladspa'
+        self.multitone = False
         
         # Audio generation parameters
+        self.sample_rate = 48000
         self.duration = 1.0
         self.trim_start = 0.2
         self.trim_len = 0.6
@@ -44,6 +529,12 @@ class PluginTester:
         self.num_outputs = 0
         self.parameters = []
         self.param_names = []
+        self.plugin = None
+        self.coprocess = None
+        
+        # Sweep results: frequencies (F,) and gain in dB per channel (F, C)
+        self.freqs = None
+        self.db = None
         self.no_plot = False
         self.y_min = None
         self.y_max = None
@@ -67,7 +558,7 @@ Examples:
                           nargs='*',
                           default=[],
                           metavar='VALUE',
-                          help='Plugin parameters (control values). For RIAA: Gain Subsonic RIAA-Enable Declick-Enable Spike-Threshold Spike-Width Store-Settings')
+                          help='Plugin parameters (control values). For RIAA: Gain Subsonic RIAA-Enable Declick-Enable Spike-Threshold Spike-Width Notch-Enable Notch-Freq Notch-Q Store-Settings')
         
         parser.add_argument('--output', '-o',
                           metavar='FILE',
@@ -97,6 +588,32 @@ Examples:
                           metavar='SEC',
                           help='Test signal duration in seconds (default: 1.0)')
         
+        parser.add_argument('--sample-rate',
+                          type=int,
+                          default=48000,
+                          metavar='HZ',
+                          help='Sample rate of the test signal (default: 48000)')
+        
+        parser.add_argument('--multitone',
+                          action='store_true',
+                          help='Measure all frequencies at once with a single multi-tone signal and FFT '
+                               '(in-process backend only; valid for linear settings, i.e. declick off)')
+        
+        parser.add_argument('--backend',
+                          choices=['ladspa', 'external', 'coprocess', 'reference'],
+                          default='ladspa',
+                          help='How the plugin is run: "ladspa" loads it in-process via ctypes, '
+                               '"external" runs riaa_process/sox once per frequency, '
+                               '"coprocess" keeps one riaa_process --stdin-mode running (riaa only), '
+                               '"reference" applies the ideal RIAA filters with scipy instead of '
+                               'the plugin (riaa only) (default: ladspa)')
+        
+        parser.add_argument('--jobs', '-j',
+                          type=int,
+                          default=2 * (os.cpu_count() or 1),
+                          metavar='N',
+                          help='Number of plugin runs in flight at once with --backend external (default: 2x number of CPUs)')
+        
         parser.add_argument('--y-min',
                           type=float,
                           metavar='DB',
@@ -137,6 +654,10 @@ Examples:
         self.f_max = args.f_max
         self.steps_per_oct = args.steps
         self.duration = args.duration
+        self.sample_rate = args.sample_rate
+        self.multitone = args.multitone
+        self.jobs = max(1, args.jobs)
+        self.backend = args.backend
         self.no_plot = args.no_plot
         self.y_min = args.y_min
         self.y_max = args.y_max
@@ -147,8 +668,10 @@ Examples:
         """Get plugin information using analyseplugin."""
         try:
             result = subprocess.run(
-                ['analyseplugin', self.plugin_path],
-                capture_output=True,
+                [self.analyseplugin, self.plugin_path],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                close_fds=False,
                 text=True,
                 check=True
             )
@@ -157,29 +680,26 @@ Examples:
             print(f"Error: Failed to analyze plugin {self.plugin_path}")
             sys.exit(1)
         
-        # Extract plugin name and label
-        for line in output.split('\n'):
-            if 'Plugin Name:' in line:
+        # Extract plugin name, label, audio port counts and control port
+        # names in one pass
+        n_in = n_out = 0
+        self.param_names = []
+        for line in output.splitlines():
+            if 'input, audio' in line:
+                n_in += 1
+            elif 'output, audio' in line:
+                n_out += 1
+            elif 'input, control' in line:
+                match = _NAME_RE.search(line)
+                if match:
+                    self.param_names.append(match.group(1))
+            elif 'Plugin Name:' in line:
                 self.plugin_name = line.split('"')[1] if '"' in line else line.split(':')[1].strip()
             elif 'Plugin Label:' in line:
                 self.plugin_label = line.split('"')[1] if '"' in line else line.split(':')[1].strip()
         
-        # Count audio input and output ports
-        self.num_inputs = output.count('input, audio')
-        self.num_outputs = output.count('output, audio')
-        
-        if self.num_inputs == 0:
-            self.num_inputs = 1
-        if self.num_outputs == 0:
-            self.num_outputs = 1
-        
-        # Extract control port names
-        self.param_names = []
-        for line in output.split('\n'):
-            if 'input, control' in line:
-                match = re.search(r'"([^"]+)"', line)
-                if match:
-                    self.param_names.append(match.group(1))
+        self.num_inputs = n_in if n_in > 0 else 1
+        self.num_outputs = n_out if n_out > 0 else 1
     
     def print_plugin_info(self):
         """Print plugin information."""
@@ -196,11 +716,9 @@ Examples:
                     print(f"  {self.param_names[i]} = {param_value}")
             print()
     
-    def measure_frequency(self, frequency):
+    def measurement_window(self, frequency):
         """
-        Measure the RMS amplitude at a specific frequency for each output channel.
-        
-        Returns a list of RMS amplitudes (one per output channel), or None if measurement fails.
+        Return (duration, trim_start, trim_len) in seconds for a test frequency.
         """
         # Calculate frequency-dependent duration to capture at least 100 cycles
         # or minimum of 1 second for low frequencies
@@ -215,109 +733,121 @@ Examples:
         trim_start = 0.2 * adaptive_duration / self.duration
         trim_len = 0.6 * adaptive_duration / self.duration
         
-        # Create temporary files
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp:
-            tmp_input = tmp.name
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp:
-            tmp_output = tmp.name
+        return adaptive_duration, trim_start, trim_len
+    
+    def test_signal(self, frequency, duration):
+        """Generate a full-scale sine with one column per input channel."""
+        sr = self.sample_rate
+        t = np.arange(int(sr * duration)) / sr
+        sig = np.sin(2 * np.pi * frequency * t).astype(np.float32)
+        return np.tile(sig[:, np.newaxis], (1, self.num_inputs))
+    
+    def segment_rms(self, data, sr, trim_start, trim_len):
+        """
+        RMS of each output channel over the trimmed segment,
+        skipping the filter's start-up transient.
+        """
+        start = min(int(trim_start * sr), data.shape[0])
+        stop = min(int((trim_start + trim_len) * sr), data.shape[0])
+        return rms_segment(data, start, stop).tolist()
+    
+    def measure_frequency(self, frequency):
+        """
+        Measure the RMS amplitude at a specific frequency for each output channel,
+        running the plugin in-process.
+        
+        Returns a list of RMS amplitudes (one per output channel).
+        """
+        adaptive_duration, trim_start, trim_len = self.measurement_window(frequency)
+        sig = self.test_signal(frequency, adaptive_duration)
+        data = self.plugin.process(sig)
+        return self.segment_rms(data, self.sample_rate, trim_start, trim_len)
+    
+    def measure_frequency_coprocess(self, frequency):
+        """
+        Measure the RMS amplitude at a specific frequency for each output channel,
+        using the persistent riaa_process co-process.
         
+        Returns a list of RMS amplitudes (one per output channel), or None if measurement fails.
+        """
         try:
-            # Generate input signal with sox
-            sox_cmd = [
-                'sox', '-n', tmp_input,
-                'synth', str(adaptive_duration), 'sine', str(frequency),
-                'channels', str(self.num_inputs),
-                'trim', str(trim_start), str(trim_len)
-            ]
-            
-            result = subprocess.run(
-                sox_cmd,
-                capture_output=True,
-                text=True
-            )
+            return self.coprocess.measure(frequency, *self.measurement_window(frequency))
+        except RuntimeError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Failed to measure at {frequency} Hz: {e}", file=sys.stderr)
+            return None
+    
+    async def measure_frequency_async(self, frequency, limit):
+        """
+        Measure the RMS amplitude at a specific frequency for each output channel,
+        running the plugin as an external process.
+        
+        The plugin run is started as an asyncio subprocess while holding the
+        semaphore `limit`, so many measurements can be in flight at once.
+        
+        Returns a list of RMS amplitudes (one per output channel), or None if measurement fails.
+        """
+        adaptive_duration, trim_start, trim_len = self.measurement_window(frequency)
+        
+        await limit.acquire()
+        tmp_dir = None
+        
+        try:
+            # Create temporary files in a private directory, so measurements
+            # running in parallel never collide
+            tmp_dir = tempfile.mkdtemp(prefix='test-plugin-', dir=self.tmp_root)
+            tmp_input = str(Path(tmp_dir) / 'input.wav')
+            tmp_output = str(Path(tmp_dir) / 'output.wav')
             
-            if result.returncode != 0:
-                return None
+            # Generate input signal in-process (one column per input channel)
+            sig = self.test_signal(frequency, adaptive_duration)
+            sf.write(tmp_input, sig, self.sample_rate, subtype='FLOAT')
             
             # Process through riaa_process instead of LADSPA
             # Check if we're testing the riaa plugin
             if self.plugin_label == 'riaa':
                 # Use riaa_process native tool
-                riaa_cmd = ['./riaa_process', tmp_input, tmp_output] + self.parameters
-                result = subprocess.run(
-                    riaa_cmd,
-                    capture_output=True,
-                    text=True
-                )
-                
-                if result.returncode != 0:
-                    return None
-                    
-                tmp_file = tmp_output
+                cmd = ['./riaa_process', tmp_input, tmp_output] + self.parameters
             else:
                 # For other plugins, try using sox LADSPA
                 cmd = [
-                    'sox', tmp_input, tmp_output,
+                    self.sox, tmp_input, tmp_output,
                     'ladspa', self.plugin_path, self.plugin_label
                 ] + self.parameters
-                
-                result = subprocess.run(
-                    cmd,
-                    capture_output=True,
-                    text=True
-                )
-                
-                if result.returncode != 0:
-                    return None
-                    
-                tmp_file = tmp_output
             
-            # Now measure each channel individually
-            rms_values = []
-            for ch in range(self.num_outputs):
-                # Extract single channel and measure RMS
-                stat_cmd = [
-                    'sox', tmp_file, '-n',
-                    'remix', str(ch + 1),
-                    'stat'
-                ]
-                
-                stat_result = subprocess.run(
-                    stat_cmd,
-                    capture_output=True,
-                    text=True
-                )
-                
-                # Parse RMS amplitude from output
-                output = stat_result.stdout + stat_result.stderr
-                rms = None
-                for line in output.split('\n'):
-                    if 'RMS' in line and 'amplitude:' in line:
-                        match = re.search(r'amplitude:\s+(\S+)', line)
-                        if match:
-                            rms = float(match.group(1))
-                            break
-                
-                rms_values.append(rms if rms is not None else 0.0)
+            # Python creates its own fds non-inheritable (PEP 446), so
+            # close_fds=False passes nothing extra and skips the close loop
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                close_fds=False
+            )
+            
+            if await proc.wait() != 0:
+                return None
             
-            return rms_values
+            data, sr = sf.read(tmp_output, dtype='float32', always_2d=True)
+            return self.segment_rms(data, sr, trim_start, trim_len)
             
-        except (subprocess.CalledProcessError, ValueError) as e:
+        except (OSError, ValueError, RuntimeError) as e:
             print(f"Warning: Failed to measure at {frequency} Hz: {e}", file=sys.stderr)
             return None
         finally:
             # Clean up temporary files
-            for f in [tmp_input, tmp_output]:
-                try:
-                    Path(f).unlink()
-                except:
-                    pass
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            limit.release()
     
     def rms_to_db(self, rms):
         """
         Convert RMS amplitude to dB.
         
         Applies correction for sine wave RMS = peak/sqrt(2)
+        
+        run_sweep() applies the same conversion to the whole result array.
         """
         if rms <= 0:
             return -200  # Very low value for silence
@@ -328,55 +858,196 @@ Examples:
         return db
     
     def run_sweep(self):
-        """Run frequency resp or self.no_plotonse sweep."""
+        """
+        Run frequency response sweep.
+        
+        Fills self.freqs and self.db.
+        """
         print("=== Frequency Response Sweep ===")
         
-        results = []
-        frequency = self.f_min
+        # Logarithmically spaced test frequencies, computed directly from the
+        # step index (the small epsilon keeps f_max when it is an exact step)
+        n_octaves = math.log2(self.f_max / self.f_min)
+        n = int(n_octaves * self.steps_per_oct + 1e-9) + 1
+        frequencies = self.f_min * 2 ** (np.arange(n) / self.steps_per_oct)
         
-        while frequency <= self.f_max:
-            rms_values = self.measure_frequency(frequency)
-            
-            if rms_values is not None:
-                # Convert each channel's RMS to dB
-                db_values = [self.rms_to_db(rms) for rms in rms_values]
-                results.append((frequency, db_values))
+        if isinstance(self.plugin, RiaaReference):
+            # Only compare where the reference follows the analog curve
+            valid = frequencies <= self.plugin.f_max_valid
+            print(f"Reference model within {self.plugin.max_error_db:.3f} dB of the "
+                  f"analog RIAA curve up to {self.plugin.f_max_valid:.0f} Hz")
+            if not valid.all():
+                print(f"Warning: {np.count_nonzero(~valid)} frequencies above "
+                      f"{self.plugin.f_max_valid:.0f} Hz are outside the reference model's "
+                      "valid range and were skipped", file=sys.stderr)
+            frequencies = frequencies[valid]
+        
+        if self.multitone:
+            # Declick (riaa's 4th parameter) is not linear, so tones would
+            # leak into each other's bins
+            declick = (self.plugin_label == 'riaa' and len(self.parameters) > 3
+                       and float(self.parameters[3]) != 0)
+            if declick:
+                print("Warning: --multitone is not valid with declick enabled, "
+                      "measuring frequencies one by one", file=sys.stderr)
+            elif self.plugin is not None:
+                self.measure_multitone(frequencies)
+                return
             else:
-                # Use very low values for failed measurements
-                db_values = [-200] * self.num_outputs
-                results.append((frequency, db_values))
-            
-            # Calculate next frequency (logarithmic spacing)
-            frequency *= 2 ** (1 / self.steps_per_oct)
+                print("Warning: --multitone needs the in-process backend, "
+                      "measuring frequencies one by one", file=sys.stderr)
+        
+        if self.plugin is not None:
+            measurements = [self.measure_frequency(f) for f in frequencies]
+        elif self.coprocess is not None:
+            measurements = [self.measure_frequency_coprocess(f) for f in frequencies]
+        else:
+            measurements = asyncio.run(self.run_sweep_async(frequencies))
+        
+        # Failed measurements count as silence
+        rms = np.zeros((len(frequencies), self.num_outputs))
+        for i, rms_values in enumerate(measurements):
+            if rms_values is not None:
+                rms[i] = rms_values
+        
+        # Convert all RMS values to dB at once, like rms_to_db()
+        self.freqs = frequencies
+        self.db = np.where(rms > 0, 20 * np.log10(np.maximum(rms, 1e-30)) + 3.0103, -200.0)
+    
+    def measure_multitone(self, frequencies):
+        """
+        Measure all frequencies with one multi-tone signal.
+        
+        The test frequencies are snapped to FFT bins of one signal period, so
+        every tone is exactly periodic and can be read from a single bin
+        without leakage. This relies on the plugin being linear and
+        time-invariant: each tone then only produces output at its own bin.
+        
+        Fills self.freqs with the snapped frequencies and self.db.
+        """
+        sr = self.sample_rate
         
-        return results
+        # Bin spacing fine enough to keep the lowest adjacent tones two bins apart
+        spacing = self.f_min * (2 ** (1 / self.steps_per_oct) - 1) / 2
+        n = int(math.ceil(sr / spacing))
+        bins = np.unique(np.rint(frequencies * n / sr).astype(np.int64))
+        bins = bins[(bins > 0) & (bins < n // 2)]
+        if len(bins) < len(frequencies):
+            print(f"Warning: {len(frequencies) - len(bins)} frequencies are above "
+                  f"Nyquist ({sr / 2:.0f} Hz) or share a bin and were skipped", file=sys.stderr)
+        if len(bins) == 0:
+            print(f"Error: No test frequency is below Nyquist ({sr / 2:.0f} Hz)")
+            sys.exit(1)
+        
+        # Schroeder phases keep the crest factor low; with an amplitude of
+        # 1/K per tone the sum can never exceed full scale
+        k = len(bins)
+        amplitude = 1.0 / k
+        phases = -np.pi * np.arange(k) * (np.arange(k) - 1) / k
+        # Synthesise all tones at once from their spectrum:
+        # A*sin(x + phase) = A*cos(x + phase - pi/2)
+        spectrum = np.zeros(n // 2 + 1, dtype=np.complex128)
+        spectrum[bins] = amplitude * n / 2 * np.exp(1j * (phases - np.pi / 2))
+        sig = np.fft.irfft(spectrum, n)
+        
+        # The signal is periodic in n, so prepending its own tail lets the
+        # filters settle without a discontinuity; only the last period is analysed
+        settle = min(n, sr)
+        sig = np.concatenate([sig[-settle:], sig]).astype(np.float32)
+        sig = np.tile(sig[:, np.newaxis], (1, self.num_inputs))
+        
+        out = self.plugin.process(sig)[settle:]
+        spectrum = np.fft.rfft(out.astype(np.float64), axis=0)
+        gain = 2 * np.abs(spectrum[bins]) / n / amplitude
+        
+        self.freqs = bins * sr / n
+        self.db = np.where(gain > 0, 20 * np.log10(np.maximum(gain, 1e-30)), -200.0)
+    
+    async def run_sweep_async(self, frequencies):
+        """
+        Run all external measurements concurrently.
+        
+        Every frequency is queued at once; the semaphore bounds how many
+        plugin processes run at the same time and completions are reaped
+        as they finish.
+        """
+        # Measurements are independent, so run them concurrently;
+        # gather() keeps the results in frequency order
+        limit = asyncio.Semaphore(self.jobs)
+        return await asyncio.gather(
+            *[self.measure_frequency_async(f, limit) for f in frequencies]
+        )
+    
+    def open_plugin(self):
+        """Load the plugin in-process unless the external backend was requested."""
+        if self.backend == 'reference':
+            if self.plugin_label != 'riaa':
+                print(f"Error: No reference model for plugin {self.plugin_label}")
+                sys.exit(1)
+            if not HAS_SCIPY:
+                print("Error: The reference backend requires scipy")
+                sys.exit(1)
+            try:
+                self.plugin = RiaaReference(self.sample_rate, self.parameters)
+            except (RuntimeError, ValueError) as e:
+                print(f"Error: Could not build the RIAA reference model: {e}")
+                sys.exit(1)
+            return
+        if self.backend == 'coprocess':
+            if self.plugin_label != 'riaa':
+                print("Error: The coprocess backend only supports the riaa plugin")
+                sys.exit(1)
+            try:
+                self.coprocess = RiaaCoprocess(self.sample_rate, self.parameters)
+            except (OSError, RuntimeError) as e:
+                print(f"Error: Could not start riaa_process: {e}")
+                sys.exit(1)
+            return
+        if self.backend != 'ladspa':
+            return
+        try:
+            defaults = RIAA_PORT_DEFAULTS if self.plugin_label == 'riaa' else None
+            self.plugin = LadspaPlugin(self.plugin_path, self.sample_rate, self.parameters,
+                                       self.plugin_label, defaults)
+        except (OSError, AttributeError, RuntimeError, ValueError) as e:
+            print(f"Warning: Could not load {self.plugin_path} in-process ({e}), "
+                  "falling back to external processing", file=sys.stderr)
+            self.plugin = None
+            return
+        
+        # Size signals and results from the ports the loaded plugin really has
+        self.num_inputs = max(len(self.plugin.inputs), 1)
+        self.num_outputs = len(self.plugin.outputs)
+    
+    def close_plugin(self):
+        """Release the in-process plugin instance or co-process."""
+        if self.plugin is not None:
+            self.plugin.close()
+            self.plugin = None
+        if self.coprocess is not None:
+            self.coprocess.close()
+            self.coprocess = None
     
-    def write_results(self, results):
+    def write_results(self):
         """Write results to output file."""
-        with open(self.output_file, 'w') as f:
-            # Write header
-            header = "Frequency"
-            for ch in range(self.num_outputs):
-                header += f"\tChannel_{ch}"
-            f.write(header + "\n")
-            
-            # Write data
-            for freq, db_values in results:
-                line = f"{freq:.3f}"
-                for db in db_values:
-                    line += f"\t{db:.2f}"
-                f.write(line + "\n")
+        channels = self.db.shape[1]
+        header = "Frequency\t" + "\t".join(f"Channel_{ch}" for ch in range(channels))
+        np.savetxt(
+            self.output_file,
+            np.column_stack([self.freqs, self.db]),
+            fmt=['%.3f'] + ['%.2f'] * channels,
+            delimiter='\t',
+            header=header,
+            comments=''
+        )
         
-        print(f"Wrote {len(results)} lines to {self.output_file}")
+        print(f"Wrote {len(self.freqs)} lines to {self.output_file}")
     
-    def plot_results(self, results):
+    def plot_results(self):
         """Generate frequency response plot."""
         if not HAS_MATPLOTLIB:
             return
         
-        # Extract frequencies and dB values per channel
-        frequencies = [r[0] for r in results]
-        
         # Create figure
         plt.figure(figsize=(12, 6))
         
@@ -384,11 +1055,10 @@ Examples:
         colors = ['blue', 'red', 'green', 'orange', 'purple', 'brown', 'pink', 'gray']
         
         # Plot each channel
-        for ch in range(self.num_outputs):
-            db_values = [r[1][ch] for r in results]
+        for ch in range(self.db.shape[1]):
             color = colors[ch % len(colors)]
             label = f'Channel {ch}'
-            plt.semilogx(frequencies, db_values, color=color, label=label, linewidth=1.5)
+            plt.semilogx(self.freqs, self.db[:, ch], color=color, label=label, linewidth=1.5)
         
         plt.xlabel('Frequency (Hz)')
         plt.ylabel('Gain (dB)')
@@ -402,14 +1072,11 @@ Examples:
             plt.ylim(self.y_min, self.y_max)
         else:
             # Auto-scale with 10% headroom
-            all_db_values = []
-            for ch in range(self.num_outputs):
-                db_values = [r[1][ch] for r in results if r[1][ch] > -200]  # Exclude failed measurements
-                all_db_values.extend(db_values)
+            all_db_values = self.db[self.db > -200]  # Exclude failed measurements
             
-            if all_db_values:
-                data_min = min(all_db_values)
-                data_max = max(all_db_values)
+            if all_db_values.size:
+                data_min = all_db_values.min()
+                data_max = all_db_values.max()
                 range_db = data_max - data_min
                 
                 # Add 10% headroom on each side
@@ -427,14 +1094,29 @@ Examples:
         plt.savefig(plot_file, dpi=150, bbox_inches='tight')
         print(f"Saved plot to {plot_file}")
     
+    def check_process_spawning(self):
+        """Warn if subprocess has to fall back to a plain fork() for child processes."""
+        if not getattr(subprocess, '_USE_POSIX_SPAWN', False) and \
+                not getattr(subprocess, '_USE_VFORK', False):
+            print("Warning: subprocess cannot use posix_spawn() or vfork() on this system, "
+                  "starting external tools will be slower", file=sys.stderr)
+    
     def run(self, args):
         """Main test execution."""
         plugin_name = self.parse_args(args)
+        self.check_process_spawning()
         self.analyze_plugin()
         self.print_plugin_info()
-        results = self.run_sweep()
-        self.write_results(results)
-        self.plot_results(results)
+        self.open_plugin()
+        if HAS_NUMBA:
+            # Compile the RMS kernel before the sweep starts
+            rms_segment(np.zeros((16, 1), dtype=np.float32), 0, 16)
+        try:
+            self.run_sweep()
+        finally:
+            self.close_plugin()
+        self.write_results()
+        self.plot_results()
 
 
 if __name__ == '__main__':